@@ -0,0 +1,196 @@
+import asyncio
+import uuid
+from collections import deque
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import OperationFailure, PyMongoError
+from conteos import CAMPOS_CONTEOS
+
+# Colecciones cuyos cambios se envían a los clientes
+COLECCIONES = ["categorias", "enlaces", "subenlaces"]
+
+# Operaciones de los change streams de MongoDB que se traducen a eventos
+OPERACIONES = {
+    "insert": "insert",
+    "update": "update",
+    "replace": "update",
+    "delete": "delete",
+}
+
+
+class CanalCambios:
+    """Pub/sub en memoria con un búfer circular de los últimos eventos.
+
+    Todos los suscriptores esperan sobre el mismo asyncio.Event, que se
+    reemplaza en cada publicación, así que un suscriptor inactivo no tiene
+    cola propia: solo una posición en el búfer.
+    """
+
+    def __init__(self, capacidad: int = 1000):
+        self.modo = "memoria"  # "memoria" o "change_stream"
+        self._eventos = deque(maxlen=capacidad)
+        self._posiciones = {}  # token -> posición absoluta del evento
+        self._total = 0
+        self._aviso = asyncio.Event()
+        # Los tokens en memoria solo valen para este proceso
+        self._epoca = uuid.uuid4().hex[:8]
+
+    def publicar(self, operacion: str, coleccion: str, documento_id, documento=None, token: str = None):
+        if token is None:
+            token = f"{self._epoca}-{self._total + 1}"
+
+        evento = jsonable_encoder(
+            {
+                "operacion": operacion,
+                "coleccion": coleccion,
+                "_id": documento_id,
+                "documento": documento,
+            },
+            custom_encoder={ObjectId: str},
+        )
+
+        if len(self._eventos) == self._eventos.maxlen:
+            token_antiguo, _ = self._eventos[0]
+            self._posiciones.pop(token_antiguo, None)
+
+        self._eventos.append((token, evento))
+        self._posiciones[token] = self._total
+        self._total += 1
+
+        # Despertar a todos los suscriptores de una sola vez
+        aviso, self._aviso = self._aviso, asyncio.Event()
+        aviso.set()
+
+    def invalidar(self):
+        # Descarta el búfer y deja un marcador de reset: los suscriptores al
+        # día lo reciben y los tokens anteriores dejan de ser válidos
+        self._eventos.clear()
+        self._posiciones.clear()
+        self._eventos.append(("reset", None))
+        self._total += 1
+
+        aviso, self._aviso = self._aviso, asyncio.Event()
+        aviso.set()
+
+    def publicar_escritura(self, operacion: str, coleccion: str, documento_id, documento=None):
+        # Con change streams los eventos llegan desde MongoDB; evitar duplicados
+        if self.modo == "memoria":
+            self.publicar(operacion, coleccion, documento_id, documento)
+
+    async def suscribir(self, token: str = None, latido: float = 15.0):
+        """Genera (token, evento) a partir del token indicado.
+
+        Emite ("reset", None) si el token ya no está en el búfer (el cliente
+        debe volver a cargar las listas) y None cada `latido` segundos sin
+        cambios, para mantener viva la conexión.
+        """
+        if token is None:
+            posicion = self._total
+        else:
+            posicion = self._posiciones.get(token)
+            if posicion is None:
+                yield "reset", None
+                posicion = self._total
+            else:
+                posicion += 1
+
+        while True:
+            # Tomar el aviso antes de entregar para no perder publicaciones
+            aviso = self._aviso
+
+            while posicion < self._total:
+                inicio = self._total - len(self._eventos)
+                if posicion < inicio:
+                    # El cliente se quedó atrás y el búfer ya descartó eventos
+                    yield "reset", None
+                    posicion = self._total
+                    break
+                yield self._eventos[posicion - inicio]
+                posicion += 1
+
+            try:
+                await asyncio.wait_for(aviso.wait(), timeout=latido)
+            except asyncio.TimeoutError:
+                yield None
+
+
+canal_cambios = CanalCambios()
+
+
+def solo_conteos(cambio) -> bool:
+    # Los $inc de contadores no se publican en modo memoria; omitirlos también
+    # aquí para que ambos modos envíen los mismos eventos
+    if cambio["ns"]["coll"] != "categorias" or cambio["operationType"] != "update":
+        return False
+    descripcion = cambio.get("updateDescription", {})
+    campos = set(descripcion.get("updatedFields", {})) | set(descripcion.get("removedFields", []))
+    return campos <= set(CAMPOS_CONTEOS)
+
+
+async def replica_set_disponible(client, intentos: int = 5) -> bool:
+    for intento in range(1, intentos + 1):
+        try:
+            hello = await client.admin.command("hello")
+            return "setName" in hello
+        except PyMongoError as e:
+            print(f"No se pudo consultar el estado del servidor (intento {intento}/{intentos}): {str(e)}")
+            if intento < intentos:
+                await asyncio.sleep(2 * intento)
+
+    print("ERROR: no se pudo determinar si MongoDB es un replica set; el feed de cambios usará memoria")
+    return False
+
+
+async def vigilar_cambios(db, canal: CanalCambios = canal_cambios):
+    """Lleva los eventos de un único change stream por proceso al canal."""
+    pipeline = [{
+        "$match": {
+            "ns.coll": {"$in": COLECCIONES},
+            "operationType": {"$in": list(OPERACIONES)},
+        }
+    }]
+    resume_token = None
+    # Se activa cuando se pierden eventos y se limpia al reabrir el stream,
+    # para avisar a los clientes una sola vez por hueco y no en cada reintento
+    hueco = False
+
+    while True:
+        try:
+            async with db.watch(
+                pipeline,
+                full_document="updateLookup",
+                resume_after=resume_token,
+            ) as stream:
+                # El token posterior al lote avanza aunque no haya cambios
+                resume_token = stream.resume_token or resume_token
+                if hueco:
+                    canal.invalidar()
+                    hueco = False
+
+                while stream.alive:
+                    cambio = await stream.try_next()
+                    resume_token = stream.resume_token
+                    if cambio is None or solo_conteos(cambio):
+                        continue
+                    canal.publicar(
+                        OPERACIONES[cambio["operationType"]],
+                        cambio["ns"]["coll"],
+                        cambio["documentKey"]["_id"],
+                        cambio.get("fullDocument"),
+                        token=cambio["_id"]["_data"],
+                    )
+        except OperationFailure as e:
+            # El token ya no está en el oplog: continuar desde el presente
+            print(f"Error en el change stream: {str(e)}")
+            resume_token = None
+            hueco = True
+            await asyncio.sleep(5)
+        except PyMongoError as e:
+            print(f"Error en el change stream: {str(e)}")
+            await asyncio.sleep(5)
+        except Exception as e:
+            # El cambio que provocó el error ya no se puede entregar
+            print(f"Error inesperado en el change stream: {str(e)}")
+            hueco = True
+            await asyncio.sleep(5)
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from config import client
+
+# Cada cuánto se recalculan los contadores desde cero (segundos)
+INTERVALO_MINIMO = 60
+INTERVALO_RECONCILIACION = max(INTERVALO_MINIMO, int(os.getenv("CONTEOS_RECONCILIAR_SEGUNDOS", "3600")))
+
+# Campos de cada categoría que mantienen los contadores
+CAMPOS_CONTEOS = ("total_enlaces", "total_subenlaces")
+
+# Reintentos para las categorías que cambian mientras se reconcilian
+INTENTOS_RECONCILIACION = 3
+
+# Identifica al worker que tiene reservada una tarea periódica
+PROCESO = uuid.uuid4().hex
+
+# Se activa en main.py cuando MongoDB corre como replica set
+usar_transacciones = False
+
+
+async def en_transaccion(funcion):
+    """Ejecuta `funcion(session)` en una transacción si hay replica set.
+
+    Sin replica set no hay transacciones y se ejecuta con session=None; la
+    reconciliación periódica corrige los desvíos que puedan quedar.
+    """
+    if not usar_transacciones:
+        return await funcion(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(funcion)
+
+
+async def incrementar_conteos(db, categoria_id, enlaces: int = 0, subenlaces: int = 0, session=None):
+    if categoria_id is None:
+        return
+    await db["categorias"].update_one(
+        {"_id": categoria_id},
+        {"$inc": {"total_enlaces": enlaces, "total_subenlaces": subenlaces}},
+        session=session
+    )
+
+
+async def categoria_de_enlace(db, enlace_id, session=None):
+    enlace = await db["enlaces"].find_one({"_id": enlace_id}, {"categoria_id": 1}, session=session)
+    return enlace["categoria_id"] if enlace else None
+
+
+async def reconciliar_conteos(db) -> int:
+    """Recalcula los contadores y devuelve cuántas categorías no se pudieron
+    actualizar porque sus contadores cambiaron mientras tanto."""
+    # Leer los contadores antes de agregar: si un $inc llega después, el $set
+    # condicional no coincide y no se pisa con un valor ya desactualizado
+    categorias = await db["categorias"].find({}, {"total_enlaces": 1, "total_subenlaces": 1}).to_list(None)
+
+    # Un solo $group por colección para recalcular todos los contadores
+    enlaces = await db["enlaces"].aggregate([
+        {"$group": {"_id": "$categoria_id", "total": {"$sum": 1}}}
+    ]).to_list(None)
+
+    subenlaces = await db["subenlaces"].aggregate([
+        {"$group": {"_id": "$enlace_id", "total": {"$sum": 1}}},
+        {"$lookup": {"from": "enlaces", "localField": "_id", "foreignField": "_id", "as": "enlace"}},
+        {"$unwind": "$enlace"},
+        {"$group": {"_id": "$enlace.categoria_id", "total": {"$sum": "$total"}}}
+    ]).to_list(None)
+
+    totales_enlaces = {item["_id"]: item["total"] for item in enlaces}
+    totales_subenlaces = {item["_id"]: item["total"] for item in subenlaces}
+
+    operaciones = []
+    for categoria in categorias:
+        # None coincide con un campo ausente en el filtro
+        actual_enlaces = categoria.get("total_enlaces")
+        actual_subenlaces = categoria.get("total_subenlaces")
+        nuevo_enlaces = totales_enlaces.get(categoria["_id"], 0)
+        nuevo_subenlaces = totales_subenlaces.get(categoria["_id"], 0)
+
+        if (actual_enlaces, actual_subenlaces) == (nuevo_enlaces, nuevo_subenlaces):
+            continue
+
+        operaciones.append(UpdateOne(
+            {
+                "_id": categoria["_id"],
+                "total_enlaces": actual_enlaces,
+                "total_subenlaces": actual_subenlaces
+            },
+            {"$set": {"total_enlaces": nuevo_enlaces, "total_subenlaces": nuevo_subenlaces}}
+        ))
+
+    if not operaciones:
+        return 0
+
+    result = await db["categorias"].bulk_write(operaciones, ordered=False)
+    return len(operaciones) - result.matched_count
+
+
+async def tomar_turno(db, nombre: str, segundos: int) -> bool:
+    """Reserva la tarea `nombre` para este proceso durante `segundos`.
+
+    Si otro proceso tiene la reserva vigente, el upsert intenta insertar un
+    _id repetido y falla, así que solo un worker ejecuta la tarea.
+    """
+    ahora = datetime.now(timezone.utc)
+    try:
+        await db["tareas"].update_one(
+            {"_id": nombre, "hasta": {"$lt": ahora}},
+            {"$set": {"hasta": ahora + timedelta(seconds=segundos), "proceso": PROCESO}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def segundos_para_turno(db, nombre: str) -> float:
+    # Tiempo hasta que expire la reserva de otro proceso
+    tarea = await db["tareas"].find_one({"_id": nombre})
+    if not tarea:
+        return 1
+    hasta = tarea["hasta"]
+    if hasta.tzinfo is None:
+        hasta = hasta.replace(tzinfo=timezone.utc)
+    restante = (hasta - datetime.now(timezone.utc)).total_seconds()
+    return min(max(restante + 1, 1), INTERVALO_RECONCILIACION)
+
+
+async def reconciliar_periodicamente(db):
+    nombre = "reconciliar_conteos"
+    while True:
+        espera = INTERVALO_RECONCILIACION
+        try:
+            # La reserva dura un intervalo: al despertar ya expiró y otro
+            # proceso puede tomarla si este se detuvo
+            if await tomar_turno(db, nombre, INTERVALO_RECONCILIACION):
+                for intento in range(INTENTOS_RECONCILIACION):
+                    pendientes = await reconciliar_conteos(db)
+                    if not pendientes:
+                        break
+                else:
+                    print(f"{pendientes} categorías cambiaron durante la reconciliación; se reintentará más tarde")
+            else:
+                # Otro proceso tiene el turno: reintentar cuando expire
+                espera = await segundos_para_turno(db, nombre)
+        except Exception as e:
+            print(f"Error al reconciliar conteos: {str(e)}")
+            espera = INTERVALO_MINIMO
+        await asyncio.sleep(espera)
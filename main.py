@@ -1,15 +1,52 @@
 # backend/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import os
 
+from config import client, db
+from cambios import canal_cambios, replica_set_disponible, vigilar_cambios
+import conteos
+from conteos import reconciliar_periodicamente
+
 from routers.categorias import router as categorias_router
 from routers.enlaces import router as enlaces_router
 from routers.subenlaces import router as subenlaces_router
-from routers.usuarios import router as usuarios_router
+from routers.usuarios import router as usuarios_router, crear_superadmin_por_defecto
 from routers.noticias import router as noticias_router
+from routers.catalogo import router as catalogo_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Crear superadmin por defecto al iniciar la aplicación
+    await crear_superadmin_por_defecto(db)
+
+    tareas = []
+
+    # Usar change streams si MongoDB corre como replica set; si no, los
+    # routers publican sus escrituras en el canal en memoria
+    if await replica_set_disponible(client):
+        canal_cambios.modo = "change_stream"
+        conteos.usar_transacciones = True
+        tareas.append(asyncio.create_task(vigilar_cambios(db)))
+        print("Feed de cambios usando change streams de MongoDB")
+    else:
+        print("Feed de cambios usando pub/sub en memoria")
 
-app = FastAPI()
+    # Recalcular los contadores por categoría; solo el worker que tome el
+    # turno en MongoDB ejecuta la reconciliación
+    tareas.append(asyncio.create_task(reconciliar_periodicamente(db)))
+
+    yield
+
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configurar CORS
 
@@ -36,6 +73,8 @@ app.include_router(enlaces_router, prefix="/enlaces", tags=["enlaces"])
 
 app.include_router(subenlaces_router, prefix="/subenlaces", tags=["subenlaces"])
 
+app.include_router(catalogo_router, prefix="/catalogo", tags=["catalogo"])
+
 @app.get("/")
 def read_root():
     return {"message": "¡Catalogo lml!"}
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import json
+from cambios import canal_cambios
+
+router = APIRouter()
+
+
+def formatear_evento(token: str, evento: Optional[dict]) -> str:
+    if token == "reset":
+        # "id" vacío borra el Last-Event-ID del cliente, que ya no es válido
+        return "id\nevent: reset\ndata: {}\n\n"
+    return f"id: {token}\nevent: cambio\ndata: {json.dumps(evento)}\n\n"
+
+
+@router.get("/cambios", response_description="Feed de cambios del catálogo (Server-Sent Events)")
+async def leer_cambios(desde: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    # EventSource reenvía el último id recibido en la cabecera Last-Event-ID
+    token = last_event_id or desde
+
+    async def generar():
+        yield "retry: 3000\n\n"
+        async for item in canal_cambios.suscribir(token):
+            if item is None:
+                yield ": latido\n\n"
+            else:
+                yield formatear_evento(*item)
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -5,6 +5,8 @@ from fastapi.encoders import jsonable_encoder
 from models import Categoria
 from pydantic import ValidationError
 from config import db
+from cambios import canal_cambios
+from conteos import CAMPOS_CONTEOS
 from fastapi import status
 
 
@@ -26,7 +28,9 @@ async def crear_categoria(categoria: Categoria):
             )
 
         # Insertar la nueva categoría en la base de datos
-        result = await db["categorias"].insert_one(categoria.dict())
+        nueva_categoria = categoria.dict()
+        result = await db["categorias"].insert_one(nueva_categoria)
+        canal_cambios.publicar_escritura("insert", "categorias", result.inserted_id, nueva_categoria)
         
         return {"mensaje": "Categoría creada con éxito"}
     
@@ -58,6 +62,7 @@ async def actualizar_categoria(categoria_id: str, categoria: Categoria):
             raise HTTPException(status_code=404, detail="Categoría no encontrada o sin cambios")
 
         categoria_actualizada = await db["categorias"].find_one({"_id": categoria_id_obj})
+        canal_cambios.publicar_escritura("update", "categorias", categoria_id_obj, categoria_actualizada)
 
         return {
             "mensaje": "Categoría actualizada exitosamente",
@@ -72,9 +77,34 @@ async def actualizar_categoria(categoria_id: str, categoria: Categoria):
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @router.get("/", response_description="Listar todas las categorías")
-async def leer_categorias():
+async def leer_categorias(con_conteos: bool = False):
+    if not con_conteos:
+        categorias = await db["categorias"].find({}, {campo: 0 for campo in CAMPOS_CONTEOS}).to_list(1000)
+        return jsonable_encoder([{**categoria, "_id": str(categoria["_id"]), "nombre": categoria["nombre"]} for categoria in categorias])
+
+    # Los contadores se mantienen en cada categoría, así que leerlos no cuesta nada extra
     categorias = await db["categorias"].find().to_list(1000)
-    return jsonable_encoder([{**categoria, "_id": str(categoria["_id"]), "nombre": categoria["nombre"]} for categoria in categorias])
+    return jsonable_encoder([
+        {
+            **categoria,
+            "_id": str(categoria["_id"]),
+            "nombre": categoria["nombre"],
+            "total_enlaces": categoria.get("total_enlaces", 0),
+            "total_subenlaces": categoria.get("total_subenlaces", 0)
+        }
+        for categoria in categorias
+    ])
+
+@router.get("/conteos", response_description="Conteos de enlaces y subenlaces por categoría")
+async def leer_conteos():
+    categorias = await db["categorias"].find({}, {"total_enlaces": 1, "total_subenlaces": 1}).to_list(1000)
+    return {
+        str(categoria["_id"]): {
+            "total_enlaces": categoria.get("total_enlaces", 0),
+            "total_subenlaces": categoria.get("total_subenlaces", 0)
+        }
+        for categoria in categorias
+    }
 
 @router.delete("/{categoria_id}", response_description="Eliminar una categoría")
 async def eliminar_categoria(categoria_id: str):
@@ -90,6 +120,8 @@ async def eliminar_categoria(categoria_id: str):
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Categoría no encontrada")
 
+        canal_cambios.publicar_escritura("delete", "categorias", categoria_id)
+
         return {"mensaje": "Categoría eliminada exitosamente"}
 
     except Exception as e:
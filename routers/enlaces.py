@@ -5,6 +5,8 @@ from fastapi.encoders import jsonable_encoder
 from models import Enlace
 from pydantic import HttpUrl,ValidationError
 from config import db
+from cambios import canal_cambios
+from conteos import en_transaccion, incrementar_conteos
 from fastapi import status
 
 router = APIRouter()
@@ -42,10 +44,17 @@ async def crear_enlace(enlace: Enlace):
             "categoria_id": categoria_id,
         }
         
-        result = await db["enlaces"].insert_one(nuevo_enlace)
-        
-        if not result.inserted_id:
-            raise HTTPException(status_code=500, detail="No se pudo crear el enlace")
+        async def insertar(session):
+            result = await db["enlaces"].insert_one(nuevo_enlace, session=session)
+            
+            if not result.inserted_id:
+                raise HTTPException(status_code=500, detail="No se pudo crear el enlace")
+
+            await incrementar_conteos(db, categoria_id, enlaces=1, session=session)
+            return result
+
+        result = await en_transaccion(insertar)
+        canal_cambios.publicar_escritura("insert", "enlaces", result.inserted_id, nuevo_enlace)
 
         return {"mensaje": "Enlace creado exitosamente", "_id": str(result.inserted_id)}
 
@@ -114,14 +123,36 @@ async def actualizar_enlace(enlace_id: str, enlace: Enlace):
         if "url" in update_data:
             update_data["url"] = str(update_data["url"])
 
-        # Actualizar el enlace
-        result = await db["enlaces"].update_one({"_id": enlace_id}, {"$set": update_data})
-        
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Enlace no encontrado o sin cambios")
+        async def actualizar(session):
+            # Actualizar el enlace solo si sigue en la categoría leída, para no mover
+            # dos veces los contadores con actualizaciones concurrentes
+            result = await db["enlaces"].update_one(
+                {"_id": enlace_id, "categoria_id": enlace_actual["categoria_id"]},
+                {"$set": update_data},
+                session=session
+            )
+            
+            if result.matched_count == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="El enlace fue modificado por otra petición; vuelve a intentarlo"
+                )
+
+            if result.modified_count == 0:
+                raise HTTPException(status_code=404, detail="Enlace no encontrado o sin cambios")
+
+            # Mover los contadores si el enlace cambió de categoría; en la misma
+            # transacción que el conteo de subenlaces
+            if update_data["categoria_id"] != enlace_actual["categoria_id"]:
+                total_subenlaces = await db["subenlaces"].count_documents({"enlace_id": enlace_id}, session=session)
+                await incrementar_conteos(db, enlace_actual["categoria_id"], enlaces=-1, subenlaces=-total_subenlaces, session=session)
+                await incrementar_conteos(db, update_data["categoria_id"], enlaces=1, subenlaces=total_subenlaces, session=session)
+
+        await en_transaccion(actualizar)
 
         # Obtener el enlace actualizado para devolverlo
         enlace_actualizado = await db["enlaces"].find_one({"_id": enlace_id})
+        canal_cambios.publicar_escritura("update", "enlaces", enlace_id, enlace_actualizado)
         
         return {
             "mensaje": "Enlace actualizado exitosamente",
@@ -133,6 +164,8 @@ async def actualizar_enlace(enlace_id: str, enlace: Enlace):
                 "categoria_id": str(enlace_actualizado["categoria_id"])
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error al actualizar enlace: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
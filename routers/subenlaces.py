@@ -5,6 +5,8 @@ from fastapi.encoders import jsonable_encoder
 from models import Subenlace
 from pydantic import HttpUrl,ValidationError
 from config import db
+from cambios import canal_cambios
+from conteos import en_transaccion, incrementar_conteos, categoria_de_enlace
 from pydantic import constr
 
 router = APIRouter()
@@ -48,14 +50,24 @@ async def crear_subenlace(subenlace: Subenlace):
             "enlace_id": ObjectId(subenlace.enlace_id)  # Relacionar con el enlace
         }
 
-        # Insertar el subenlace en la base de datos
-        result = await db["subenlaces"].insert_one(nuevo_subenlace)
+        async def insertar(session):
+            # Insertar el subenlace en la base de datos
+            result = await db["subenlaces"].insert_one(nuevo_subenlace, session=session)
 
-        if not result.inserted_id:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="No se pudo crear el subenlace"
-            )
+            if not result.inserted_id:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="No se pudo crear el subenlace"
+                )
+
+            # Releer la categoría después de insertar: el enlace pudo cambiar
+            # de categoría desde que se leyó arriba
+            categoria_id = await categoria_de_enlace(db, nuevo_subenlace["enlace_id"], session=session)
+            await incrementar_conteos(db, categoria_id, subenlaces=1, session=session)
+            return result
+
+        result = await en_transaccion(insertar)
+        canal_cambios.publicar_escritura("insert", "subenlaces", result.inserted_id, nuevo_subenlace)
 
         return {"mensaje": "Subenlace creado exitosamente", "_id": str(result.inserted_id)}
 
@@ -158,14 +170,35 @@ async def actualizar_subenlace(subenlace_id: str, subenlace: Subenlace):
                 )
             update_data["titulo"] = subenlace.titulo  # Solo agregar si ha cambiado
 
-        # Actualizar el subenlace en la base de datos
-        result = await db["subenlaces"].update_one(
-            {"_id": subenlace_id_obj},
-            {"$set": update_data}
-        )
+        async def actualizar(session):
+            # Actualizar el subenlace en la base de datos
+            # Solo si sigue en el enlace leído, para no mover dos veces el contador
+            result = await db["subenlaces"].update_one(
+                {"_id": subenlace_id_obj, "enlace_id": subenlace_actual["enlace_id"]},
+                {"$set": update_data},
+                session=session
+            )
+
+            if result.matched_count == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="El subenlace fue modificado por otra petición; vuelve a intentarlo"
+                )
+
+            # Mover el contador si el subenlace pasó a otro enlace. Se escribe en
+            # ambas categorías aunque sean la misma (resultado neto 0) para que la
+            # transacción choque con un actualizar_enlace que mueva el enlace anterior
+            if enlace_id_obj != subenlace_actual["enlace_id"]:
+                categoria_anterior = await categoria_de_enlace(db, subenlace_actual["enlace_id"], session=session)
+                categoria_nueva = await categoria_de_enlace(db, enlace_id_obj, session=session)
+                await incrementar_conteos(db, categoria_anterior, subenlaces=-1, session=session)
+                await incrementar_conteos(db, categoria_nueva, subenlaces=1, session=session)
+
+        await en_transaccion(actualizar)
         
         # Obtener el subunelace actualizado para devolverlo
         subunelace_actualizado = await db["subenlaces"].find_one({"_id": subenlace_id_obj})
+        canal_cambios.publicar_escritura("update", "subenlaces", subenlace_id_obj, subunelace_actualizado)
 
         return {
             "mensaje": "Subunelace actualizado exitosamente",
@@ -178,6 +211,8 @@ async def actualizar_subenlace(subenlace_id: str, subenlace: Subenlace):
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error al actualizar subunelace: {str(e)}")
         raise HTTPException(
@@ -198,14 +233,22 @@ async def eliminar_subenlace(subenlace_id: str):
 
         subenlace_id_obj = ObjectId(subenlace_id)
 
-        # Eliminar el subenlace de la base de datos
-        result = await db["subenlaces"].delete_one({"_id": subenlace_id_obj})
+        async def eliminar(session):
+            # Eliminar el subenlace de la base de datos
+            subenlace_eliminado = await db["subenlaces"].find_one_and_delete({"_id": subenlace_id_obj}, session=session)
 
-        if result.deleted_count == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Subenlace no encontrado"
-            )
+            if not subenlace_eliminado:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Subenlace no encontrado"
+                )
+
+            categoria_id = await categoria_de_enlace(db, subenlace_eliminado["enlace_id"], session=session)
+            await incrementar_conteos(db, categoria_id, subenlaces=-1, session=session)
+
+        await en_transaccion(eliminar)
+
+        canal_cambios.publicar_escritura("delete", "subenlaces", subenlace_id_obj)
 
         return {"mensaje": "Subenlace eliminado exitosamente"}
 
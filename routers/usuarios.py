@@ -38,12 +38,6 @@ async def crear_superadmin_por_defecto(db):
         print("Superadmin por defecto ya existe")
 
 
-@router.on_event("startup")
-async def startup_event():
-    # Crear superadmin por defecto al iniciar la aplicación (Nota: Esto debe estar en main.py realmente)
-    await crear_superadmin_por_defecto(db)
-
-
 @router.post("/superadmin/")
 async def crear_superadministrador(user: User):
     existing_user = await db["usuarios"].find_one({"username": user.username})